@@ -1,41 +1,195 @@
 '''--------------------------------------------------------IMPORTS--------------------------------------------------------'''
 
+# eventlet must patch blocking I/O (requests, pymongo, threading locks) before anything else is imported
+import os
+from dotenv import load_dotenv
+load_dotenv()
+if os.getenv('ASYNC_MODE', 'eventlet') == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+
 from flask import Flask, request, render_template, session, redirect, url_for, flash, jsonify, get_flashed_messages
 from flask_socketio import SocketIO, join_room, leave_room, emit, send
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError
 from flask_sqlalchemy import SQLAlchemy
-from dotenv import load_dotenv
 import random
 import string
-import os
 import re
 import datetime
 import requests
 import base64
 import json
 import urllib.parse
-from collections import defaultdict
-
-# .env file
-load_dotenv()
+import threading
+import time
+import bisect
+import functools
+import signal
+from collections import defaultdict, OrderedDict, deque
 
 # flask app initialization
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY')
 
-# SocketIO Initialization
-socketio = SocketIO(app)
+# SocketIO is bound to the app in create_app(), so importing this module opens no connections
+socketio = SocketIO()
+
+# Server configuration
+ASYNC_MODE = os.getenv('ASYNC_MODE', 'eventlet')  # 'eventlet' or 'threading'
+SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE')  # Required when running more than one worker
+HOST = os.getenv('HOST', '0.0.0.0')
+PORT = int(os.getenv('PORT', 4444))
+
+# Seconds between telling clients to reconnect elsewhere and shutting down on SIGTERM
+DRAIN_GRACE_SECONDS = int(os.getenv('DRAIN_GRACE_SECONDS', 10))
+
+# Set once a SIGTERM has been received; joins are refused from then on
+server_state = {'initialized': False, 'draining': False}
 
 # Global dictionary to store room playback states
 # Key: room_key, Value: {'track_uri': str, 'position_ms': int, 'is_paused': bool, 'track_info': dict}
 room_states = {}
 
+# Rooms whose playback state changed since the last snapshot flush to Mongo
+dirty_rooms = set()
+
+# Key: room_key, Value: epoch seconds of the last playback state change (used to advance position on recovery)
+room_state_updated_at = {}
+
+# Rooms already looked up in the snapshot collection since this process started
+rooms_checked_for_snapshot = set()
+
 # Keep track of clients in each room to count listeners
 room_listeners = defaultdict(set)
 
 def get_room_users(room_key):
     return len(room_listeners[room_key])
 
+'''--------------------------------------------------------RATE-LIMITING--------------------------------------------------------'''
+
+# Token-bucket budgets per event type as (tokens per second, burst) for each scope.
+# Override any of them with a JSON object in the RATE_LIMITS env var, e.g. {"send_message": {"sid": [1, 3]}}
+RATE_LIMITS = {
+    'song_update':        {'sid': (5, 10), 'user': (10, 20), 'room': (20, 40)},
+    'song_play':          {'sid': (1, 3),  'user': (2, 5),   'room': (2, 5)},
+    'player_toggle_play': {'sid': (2, 5),  'user': (4, 8),   'room': (5, 10)},
+    'player_seek':        {'sid': (2, 5),  'user': (4, 8),   'room': (5, 10)},
+    'send_message':       {'sid': (2, 5),  'user': (3, 8),   'room': (20, 40)},
+    'sync_request':       {'sid': (1, 3),  'user': (2, 6)},
+    'api_search':         {'user': (2, 5)},
+    'api_tracks':         {'user': (1, 5)},
+    'api_suggest':        {'user': (10, 20)},
+}
+for event_name, scopes in json.loads(os.getenv('RATE_LIMITS', '{}')).items():
+    RATE_LIMITS.setdefault(event_name, {}).update({scope: tuple(budget) for scope, budget in scopes.items()})
+
+# Event priorities for load shedding: low priority events are dropped first when the server is overloaded
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_HIGH = 2
+
+# Events handled per second above which low (and then normal) priority events are shed. High priority is never shed
+SHED_LOW_PRIORITY_LOAD = int(os.getenv('SHED_LOW_PRIORITY_LOAD', 500))
+SHED_NORMAL_PRIORITY_LOAD = int(os.getenv('SHED_NORMAL_PRIORITY_LOAD', 1000))
+
+# Key: (event_name, scope, id), Value: [tokens, last_refill], kept in LRU order
+rate_limit_buckets = OrderedDict()
+rate_limit_lock = threading.Lock()
+RATE_LIMIT_MAX_BUCKETS = 10000
+
+# Events seen in the current one-second window, used as the global load signal
+load_window = {'started_at': time.time(), 'events': 0, 'last_load': 0}
+
+# Key: event_name, Value: number of events dropped
+throttled_events = defaultdict(int)
+shed_events = defaultdict(int)
+
+def take_token(key, rate, burst):
+    """Consume one token from the bucket for key, returning False if it is empty. Caller must hold rate_limit_lock"""
+    now = time.time()
+    bucket = rate_limit_buckets.get(key)
+    if bucket is None:
+        bucket = rate_limit_buckets[key] = [burst, now]
+        # Evicting the least recently used bucket only resets it to full, so this is O(1) and safe under load
+        if len(rate_limit_buckets) > RATE_LIMIT_MAX_BUCKETS:
+            rate_limit_buckets.popitem(last=False)
+    else:
+        rate_limit_buckets.move_to_end(key)
+    bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+    bucket[1] = now
+    if bucket[0] < 1:
+        return False
+    bucket[0] -= 1
+    return True
+
+def drop_sid_buckets(sid):
+    """Forget a disconnected sid's buckets"""
+    with rate_limit_lock:
+        for event_name in RATE_LIMITS:
+            rate_limit_buckets.pop((event_name, 'sid', sid), None)
+
+def current_load():
+    """Count this event towards the load window and return events per second"""
+    now = time.time()
+    with rate_limit_lock:
+        if now - load_window['started_at'] >= 1:
+            load_window['last_load'] = load_window['events']
+            load_window['started_at'] = now
+            load_window['events'] = 0
+        load_window['events'] += 1
+        return max(load_window['events'], load_window['last_load'])
+
+def should_shed(priority):
+    load = current_load()
+    if priority == PRIORITY_LOW:
+        return load > SHED_LOW_PRIORITY_LOAD
+    if priority == PRIORITY_NORMAL:
+        return load > SHED_NORMAL_PRIORITY_LOAD
+    return False
+
+def allow_event(event_name, identities):
+    """Check every scope's bucket for an event; identities maps scope to id (None skips the scope)"""
+    with rate_limit_lock:
+        for scope, (rate, burst) in RATE_LIMITS.get(event_name, {}).items():
+            identity = identities.get(scope)
+            if identity is not None and not take_token((event_name, scope, identity), rate, burst):
+                throttled_events[event_name] += 1
+                return False
+    return True
+
+def rate_limited(event_name, priority=PRIORITY_NORMAL):
+    """Socket handler decorator applying load shedding and per sid/user/room token buckets.
+    priority may be a callable taking the event data, for events whose importance depends on content"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(data):
+            event_priority = priority(data) if callable(priority) else priority
+            if should_shed(event_priority):
+                shed_events[event_name] += 1
+                return
+            room_key = data.get('room_key') if isinstance(data, dict) else None
+            if not allow_event(event_name, {'sid': request.sid, 'user': session.get('user'), 'room': room_key}):
+                if event_priority == PRIORITY_HIGH:
+                    # Tell the sender when to retry (jittered, so throttled clients don't retry together)
+                    emit('rate_limited', {'event': event_name, 'retry_after_ms': random.randint(500, 2000)}, room=request.sid)
+                    # The sender's player already acted on playback events, so pull it back to the room's state
+                    state = get_room_state(room_key) if room_key and event_name != 'sync_request' else None
+                    if state:
+                        emit('sync_playback', state, room=request.sid)
+                return
+            return handler(data)
+        return wrapper
+    return decorator
+
+def song_update_priority(data):
+    """A song_update that only repeats the current track and pause state is redundant"""
+    current = room_states.get(data.get('room_key')) or {}
+    state = data.get('state') or {}
+    if state.get('track_uri') == current.get('track_uri') and state.get('is_paused') == current.get('is_paused'):
+        return PRIORITY_LOW
+    return PRIORITY_NORMAL
+
 '''--------------------------------------------------------SOCKET-IO-EVENTS--------------------------------------------------------'''
 
 @socketio.on('connect')
@@ -45,17 +199,31 @@ def handle_connect():
 @socketio.on('disconnect')
 def handle_disconnect():
     print("Client disconnected")
+    drop_sid_buckets(request.sid)
     # Clean up internal listener tracking for the disconnected SID
     for room_key, sids in room_listeners.items():
         if request.sid in sids:
             sids.remove(request.sid)
-            # You might also want to decrement the database listener count here
+            # The client left without 'leave' (closed tab, drain, network drop), so undo its join's increment.
+            # The room state is kept: it is what reconnecting clients sync from
+            room_data = PublicRooms.find_one({'room_key': room_key})
+            if room_data:
+                PublicRooms.update_one({'room_key': room_key, 'listeners': {'$gt': 0}}, {'$inc': {'listeners': -1}})
+            else:
+                room_data = PrivateRooms.find_one({'room_key': room_key})
+                if room_data:
+                    PrivateRooms.update_one({'room_key': room_key, 'listeners': {'$gt': 0}}, {'$inc': {'listeners': -1}})
             break
     
 @socketio.on('join')
 def on_join(data):
     username = data['username']
     room_key = data['room_key']
+
+    if server_state['draining']:
+        # Send the client to another instance instead of joining one that is about to stop
+        emit('server_draining', {'reconnect_delay_ms': random.randint(0, 3000)}, room=request.sid)
+        return
     
     join_room(room_key)
     room_listeners[room_key].add(request.sid)
@@ -72,9 +240,10 @@ def on_join(data):
     updated_listeners = updated_room_data['listeners']
     
     emit('room_message', {'msg': f'{username} has entered the room. ({updated_listeners} listeners)'}, room=room_key)
-    # If a playback state exists, sync it to the newly joined client
-    if room_key in room_states:
-        emit('sync_playback', room_states[room_key], room=request.sid)
+    # If a playback state exists (in memory or in a snapshot from before a restart), sync it to the newly joined client
+    state = get_room_state(room_key)
+    if state:
+        emit('sync_playback', state, room=request.sid)
 
 @socketio.on('leave')
 def on_leave(data):
@@ -102,10 +271,13 @@ def on_leave(data):
     
     # If the last person leaves the room, clear the state
     if get_room_users(room_key) == 0:
+        room_play_sources.pop(room_key, None)
         if room_key in room_states:
             del room_states[room_key]
+            mark_room_dirty(room_key)
 
 @socketio.on('send_message')
+@rate_limited('send_message', PRIORITY_LOW)
 def handle_message(data):
     room_key = data['room_key']
     message = data['msg']
@@ -114,6 +286,7 @@ def handle_message(data):
     emit('new_message', {'username': username, 'msg': message}, room=room_key)
 
 @socketio.on('song_play')
+@rate_limited('song_play', PRIORITY_HIGH)
 def handle_song_play(data):
     room_key = data.get('room_key')
     song = data.get('song')
@@ -126,10 +299,12 @@ def handle_song_play(data):
     print(f"Song play event in room {room_key} from sender {sender_sid}: {song.get('title', 'Unknown')} by {song.get('artist', 'Unknown')}")
     
     # Update the room state with the new song
+    duration = song.get('duration')
     room_states[room_key] = {
         'track_uri': song.get('uri'),
         'position_ms': 0,
         'is_paused': False,
+        'duration_ms': int(duration * 1000) if isinstance(duration, (int, float)) else None,
         'track_info': {
             'title': song.get('title'),
             'artist': song.get('artist'),
@@ -138,6 +313,10 @@ def handle_song_play(data):
             'duration': song.get('duration')
         }
     }
+    mark_room_dirty(room_key)
+    index_play(song.get('uri'), TRACK_INDEX_PLAY_WEIGHT)
+    record_play(room_key, song, session.get('user'))
+    room_play_sources[room_key] = {'sid': sender_sid, 'track_uri': song.get('uri')}
     
     # Get all users in the room except the sender
     room_sids = room_listeners.get(room_key, set())
@@ -159,6 +338,7 @@ def handle_song_play(data):
     print(f"📊 Broadcast summary: {len(other_sids)} recipients, sender excluded")
 
 @socketio.on('player_toggle_play')
+@rate_limited('player_toggle_play', PRIORITY_HIGH)
 def handle_player_toggle_play(data):
     room_key = data['room_key']
     is_paused = data['is_paused']
@@ -166,9 +346,11 @@ def handle_player_toggle_play(data):
 
     print(f"Received player_toggle_play event in room {room_key}: is_paused={is_paused}, position_ms={position_ms}")
     
-    if room_key in room_states:
-        room_states[room_key]['is_paused'] = is_paused
-        room_states[room_key]['position_ms'] = position_ms
+    state = get_room_state(room_key)
+    if state:
+        state['is_paused'] = is_paused
+        state['position_ms'] = position_ms
+        mark_room_dirty(room_key)
     
     emit('sync_toggle_play', {
         'is_paused': is_paused,
@@ -178,14 +360,17 @@ def handle_player_toggle_play(data):
     print(f"Broadcasted sync_toggle_play to room {room_key}")
 
 @socketio.on('player_seek')
+@rate_limited('player_seek', PRIORITY_HIGH)
 def handle_player_seek(data):
     room_key = data['room_key']
     position_ms = data['position_ms']
 
     print(f"Received player_seek event in room {room_key}: position_ms={position_ms}")
     
-    if room_key in room_states:
-        room_states[room_key]['position_ms'] = position_ms
+    state = get_room_state(room_key)
+    if state:
+        state['position_ms'] = position_ms
+        mark_room_dirty(room_key)
         
     emit('sync_seek', {
         'position_ms': position_ms
@@ -194,15 +379,27 @@ def handle_player_seek(data):
     print(f"Broadcasted sync_seek to room {room_key}")
 
 @socketio.on('song_update')
+@rate_limited('song_update', song_update_priority)
 def handle_song_update(data):
     room_key = data['room_key']
     state = data['state']
     
     # Update the server's copy of the room state
-    if room_key in room_states:
+    previous_state = get_room_state(room_key)
+    if previous_state:
+        # The client that started playback moving to a different track (next/previous) counts as a new play.
+        # Updates from other clients are not counted, so two sources flipping the state back and forth add nothing
+        source = room_play_sources.get(room_key)
+        if source and source['sid'] == request.sid and state.get('track_uri') and state['track_uri'] != source['track_uri']:
+            track_info = state.get('track_info') or {}
+            record_play(room_key, dict(track_info, uri=state['track_uri']), session.get('user'))
+            source['track_uri'] = state['track_uri']
         room_states[room_key] = state
+        mark_room_dirty(room_key)
+        index_play(state.get('track_uri'))
 
 @socketio.on('sync_request')
+@rate_limited('sync_request', PRIORITY_HIGH)
 def handle_sync_request(data):
     room_key = data.get('room_key')
     if not room_key:
@@ -210,8 +407,8 @@ def handle_sync_request(data):
         return
         
     print(f"Sync request from user in room {room_key}")
-    if room_key in room_states:
-        state = room_states[room_key]
+    state = get_room_state(room_key)
+    if state:
         print(f"Sending sync data to user: {state}")
         emit('sync_playback', state, room=request.sid) # Send only to the requesting user
     else:
@@ -220,10 +417,10 @@ def handle_sync_request(data):
 
 '''--------------------------------------------------------DATABASES--------------------------------------------------------'''
 
-# SQL initialization
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
+# SQL initialization (the engine is created when create_app() calls db.init_app)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///users.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+db = SQLAlchemy()
 
 # define SQL DataBase
 class users(db.Model):
@@ -241,14 +438,380 @@ class users(db.Model):
         self.email = email
         self.password_hash = password
 
-# PyMongo initialization
-client = MongoClient("mongodb://localhost:27017")
-mdb = client.JamRoom
+# PyMongo initialization, deferred until a collection is first used
+MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017')
+mongo_client = None
+mongo_client_lock = threading.Lock()
+
+def get_mongo_db():
+    global mongo_client
+    if mongo_client is None:
+        with mongo_client_lock:
+            if mongo_client is None:
+                mongo_client = MongoClient(MONGO_URI)
+    return mongo_client.JamRoom
+
+class LazyCollection:
+    """Stands in for a pymongo collection and connects on first attribute access"""
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_mongo_db()[self.name], attr)
 
 # PyMongo collections
-PublicRooms = mdb.PublicRooms
-PrivateRooms = mdb.PrivateRooms
-Users = mdb.Users
+PublicRooms = LazyCollection('PublicRooms')
+PrivateRooms = LazyCollection('PrivateRooms')
+Users = LazyCollection('Users')
+RoomStates = LazyCollection('RoomStates')
+PlayHistory = LazyCollection('PlayHistory')
+RoomTrackCounts = LazyCollection('RoomTrackCounts')
+RoomRollups = LazyCollection('RoomRollups')
+
+def find_room(room_key):
+    return PublicRooms.find_one({'room_key': room_key}) or PrivateRooms.find_one({'room_key': room_key})
+
+'''--------------------------------------------------------ROOM-STATE-SNAPSHOTS--------------------------------------------------------'''
+
+# Dirty room states are written to Mongo periodically so playback survives a restart
+ROOM_SNAPSHOT_INTERVAL_SECONDS = int(os.getenv('ROOM_SNAPSHOT_INTERVAL_SECONDS', 5))
+
+def mark_room_dirty(room_key):
+    room_state_updated_at[room_key] = time.time()
+    dirty_rooms.add(room_key)
+    # Memory is authoritative from now on; never rehydrate a stale snapshot over it
+    rooms_checked_for_snapshot.add(room_key)
+
+def get_room_state(room_key):
+    """Return the in-memory room state, lazily rehydrating it from its snapshot after a restart"""
+    if room_key in room_states:
+        return room_states[room_key]
+    if room_key in rooms_checked_for_snapshot:
+        return None
+
+    try:
+        # Unknown room keys are not remembered, so arbitrary keys can't grow rooms_checked_for_snapshot
+        if not find_room(room_key):
+            return None
+        snapshot = RoomStates.find_one({'room_key': room_key})
+    except Exception as e:
+        # Leave the room unchecked so the next access retries
+        print(f"Error loading snapshot for room {room_key}: {e}")
+        return None
+    rooms_checked_for_snapshot.add(room_key)
+    if not snapshot:
+        return None
+
+    state = snapshot['state']
+    updated_at = snapshot.get('updated_at', time.time())
+    # The track kept playing while we were down, so advance the position by the elapsed time
+    if not state.get('is_paused') and state.get('position_ms') is not None:
+        elapsed_ms = int((time.time() - updated_at) * 1000)
+        state['position_ms'] += max(elapsed_ms, 0)
+        # Snapshots written before song_play stored duration_ms only have track_info.duration, in seconds
+        duration_ms = state.get('duration_ms')
+        if not duration_ms and (state.get('track_info') or {}).get('duration'):
+            duration_ms = int(state['track_info']['duration'] * 1000)
+        if duration_ms and state['position_ms'] >= duration_ms:
+            state['position_ms'] = duration_ms
+            state['is_paused'] = True
+
+    room_states[room_key] = state
+    room_state_updated_at[room_key] = time.time()
+    index_play(state.get('track_uri'))
+    print(f"Recovered playback state for room {room_key} from snapshot")
+    return state
+
+def flush_room_snapshots():
+    """Write all dirty room states to Mongo in a single bulk operation"""
+    if not dirty_rooms:
+        return 0
+
+    room_keys = list(dirty_rooms)
+    dirty_rooms.difference_update(room_keys)
+    operations = []
+    for room_key in room_keys:
+        state = room_states.get(room_key)
+        if state is None:
+            operations.append(DeleteOne({'room_key': room_key}))
+        else:
+            operations.append(UpdateOne(
+                {'room_key': room_key},
+                {'$set': {'state': dict(state), 'updated_at': room_state_updated_at.get(room_key, time.time())}},
+                upsert=True
+            ))
+
+    try:
+        RoomStates.bulk_write(operations, ordered=False)
+    except Exception as e:
+        print(f"Error flushing room snapshots: {e}")
+        # Retry on the next tick
+        dirty_rooms.update(room_keys)
+        return 0
+
+    # Cleared rooms have no snapshot left, so there is nothing to rehydrate and no need to remember them
+    for room_key in room_keys:
+        if room_key not in room_states and room_key not in dirty_rooms:
+            rooms_checked_for_snapshot.discard(room_key)
+            room_state_updated_at.pop(room_key, None)
+    return len(operations)
+
+def room_snapshot_loop():
+    try:
+        RoomStates.create_index('room_key', unique=True)
+    except Exception as e:
+        print(f"Error creating RoomStates index: {e}")
+    while True:
+        socketio.sleep(ROOM_SNAPSHOT_INTERVAL_SECONDS)
+        flushed = flush_room_snapshots()
+        if flushed:
+            print(f"Flushed {flushed} room snapshots")
+
+'''--------------------------------------------------------PLAY-HISTORY--------------------------------------------------------'''
+
+# Every play is appended to PlayHistory in batches; per-room rollups are kept up to date in memory
+# as plays arrive and flushed in bulk, so the leaderboard endpoints never scan raw history
+PLAY_HISTORY_BATCH_SIZE = int(os.getenv('PLAY_HISTORY_BATCH_SIZE', 100))
+PLAY_HISTORY_FLUSH_INTERVAL_SECONDS = int(os.getenv('PLAY_HISTORY_FLUSH_INTERVAL_SECONDS', 5))
+MAX_PENDING_PLAY_HISTORY = int(os.getenv('MAX_PENDING_PLAY_HISTORY', 10000))
+ROLLUP_MAX_ROOMS = int(os.getenv('ROLLUP_MAX_ROOMS', 2000))
+RECENT_PLAYS_LIMIT = 20
+TOP_TRACKS_LIMIT = 10
+
+# Mongo error code for a duplicate key, i.e. a history document that was already inserted
+DUPLICATE_KEY_ERROR = 11000
+
+play_history_lock = threading.Lock()
+
+# History documents not yet written to Mongo, oldest first and capped at MAX_PENDING_PLAY_HISTORY
+pending_play_history = []
+# Key: (room_key, track_uri), Value: {'count': plays since the last flush, 'song': dict}
+pending_play_count_increments = {}
+
+# Key: room_key, Value: {track_uri: {'song': dict, 'count': int}}, kept in LRU order and capped at ROLLUP_MAX_ROOMS
+room_play_counts = OrderedDict()
+
+# Key: room_key, Value: up to TOP_TRACKS_LIMIT track_uris ordered by play count
+room_top_tracks = {}
+
+# Key: room_key, Value: deque of the last RECENT_PLAYS_LIMIT plays, newest first
+room_recent_plays = {}
+
+# Rooms whose rollups changed since the last flush
+dirty_rollup_rooms = set()
+
+# Key: room_key, Value: {'sid': sid that last started playback with song_play, 'track_uri': last track counted for it}
+room_play_sources = {}
+
+# 'scheduled' avoids stacking early flush tasks; 'failing' stops early flushes until a periodic one succeeds
+play_history_flush = {'scheduled': False, 'failing': False}
+
+def evict_room_rollups(keep_room_key):
+    """Drop the least recently used rooms' rollups, skipping keep_room_key and rooms with unflushed changes.
+    Caller must hold play_history_lock"""
+    for room_key in list(room_play_counts):
+        if len(room_play_counts) <= ROLLUP_MAX_ROOMS:
+            return
+        if room_key == keep_room_key or room_key in dirty_rollup_rooms:
+            continue
+        del room_play_counts[room_key]
+        del room_top_tracks[room_key]
+        del room_recent_plays[room_key]
+
+def load_room_rollups(room_key, cache_empty=True):
+    """Make sure a room's rollups are in memory, loading them from Mongo after a restart or eviction.
+    Returns False if they could not be loaded, or if the room has none and cache_empty is False"""
+    with play_history_lock:
+        if room_key in room_play_counts:
+            room_play_counts.move_to_end(room_key)
+            return True
+
+    counts = {}
+    recent = []
+    try:
+        for doc in RoomTrackCounts.find({'room_key': room_key}):
+            counts[doc['track_uri']] = {'song': doc.get('song', {}), 'count': doc.get('count', 0)}
+        rollup = RoomRollups.find_one({'room_key': room_key})
+        if rollup:
+            recent = rollup.get('recent', [])
+    except Exception as e:
+        # Don't cache a partial read; the next call retries
+        print(f"Error loading rollups for room {room_key}: {e}")
+        return False
+
+    if not counts and not recent and not cache_empty:
+        return False
+
+    with play_history_lock:
+        if room_key in room_play_counts:
+            return True
+        # Plays recorded while the room was not in memory are not in Mongo yet
+        for (pending_room_key, track_uri), pending in pending_play_count_increments.items():
+            if pending_room_key == room_key:
+                entry = counts.setdefault(track_uri, {'song': pending['song'], 'count': 0})
+                entry['count'] += pending['count']
+        room_play_counts[room_key] = counts
+        room_top_tracks[room_key] = sorted(counts, key=lambda uri: counts[uri]['count'], reverse=True)[:TOP_TRACKS_LIMIT]
+        room_recent_plays[room_key] = deque(recent, maxlen=RECENT_PLAYS_LIMIT)
+        evict_room_rollups(room_key)
+    return True
+
+def update_top_tracks(room_key, track_uri):
+    """Keep the room's top list current after track_uri's count went up. Caller must hold play_history_lock"""
+    counts = room_play_counts[room_key]
+    top = room_top_tracks[room_key]
+    if track_uri not in top:
+        if len(top) >= TOP_TRACKS_LIMIT and counts[track_uri]['count'] <= counts[top[-1]]['count']:
+            return
+        top.append(track_uri)
+    top.sort(key=lambda uri: counts[uri]['count'], reverse=True)
+    del top[TOP_TRACKS_LIMIT:]
+
+def queue_play_history(documents):
+    """Append history documents, dropping the oldest beyond MAX_PENDING_PLAY_HISTORY. Caller must hold play_history_lock"""
+    pending_play_history.extend(documents)
+    overflow = len(pending_play_history) - MAX_PENDING_PLAY_HISTORY
+    if overflow > 0:
+        del pending_play_history[:overflow]
+        print(f"Play history queue full, dropped {overflow} oldest plays")
+
+def queue_play_count_increment(key, count, song):
+    """Caller must hold play_history_lock"""
+    pending = pending_play_count_increments.setdefault(key, {'count': 0, 'song': song})
+    pending['count'] += count
+    pending['song'] = song
+
+def record_play(room_key, song, username=None):
+    """Append a play to the history log and update the room's rollups"""
+    track_uri = song.get('uri')
+    if not room_key or not track_uri:
+        return
+    # Rollups are only ever in memory for rooms that exist, so the lookup is needed once per room
+    with play_history_lock:
+        known_room = room_key in room_play_counts
+    if not known_room:
+        try:
+            if not find_room(room_key):
+                return
+        except Exception as e:
+            print(f"Error checking room {room_key} for play history: {e}")
+            return
+    rollups_loaded = load_room_rollups(room_key)
+
+    song = {field: song.get(field) for field in ('uri', 'title', 'artist', 'album', 'artwork')}
+    played_at = datetime.datetime.now()
+
+    with play_history_lock:
+        queue_play_history([{
+            'room_key': room_key,
+            'track_uri': track_uri,
+            'song': song,
+            'played_by': username,
+            'played_at': played_at
+        }])
+        queue_play_count_increment((room_key, track_uri), 1, song)
+
+        # If Mongo was unreachable the rollups load on a later call, picking up the pending increment
+        if rollups_loaded and room_key in room_play_counts:
+            entry = room_play_counts[room_key].setdefault(track_uri, {'song': song, 'count': 0})
+            entry['song'] = song
+            entry['count'] += 1
+            update_top_tracks(room_key, track_uri)
+            room_recent_plays[room_key].appendleft({'song': song, 'played_by': username, 'played_at': played_at.isoformat()})
+            dirty_rollup_rooms.add(room_key)
+
+        flush_early = (len(pending_play_history) >= PLAY_HISTORY_BATCH_SIZE
+                       and not play_history_flush['scheduled'] and not play_history_flush['failing'])
+        if flush_early:
+            play_history_flush['scheduled'] = True
+    if flush_early:
+        socketio.start_background_task(flush_play_history)
+
+def failed_write_indexes(error, ignore_codes=()):
+    """Indexes of the operations a BulkWriteError reports as not written"""
+    return {write_error['index'] for write_error in error.details.get('writeErrors', [])
+            if write_error.get('code') not in ignore_codes}
+
+def flush_play_history():
+    """Write pending history with one insert_many and rollups with one bulk_write per collection.
+    Only operations that failed are requeued, so nothing that was written is written twice"""
+    with play_history_lock:
+        history = list(pending_play_history)
+        pending_play_history.clear()
+        increments = list(pending_play_count_increments.items())
+        pending_play_count_increments.clear()
+        rollup_rooms = [room_key for room_key in dirty_rollup_rooms if room_key in room_recent_plays]
+        rollup_operations = [
+            UpdateOne({'room_key': room_key}, {'$set': {'recent': list(room_recent_plays[room_key])}}, upsert=True)
+            for room_key in rollup_rooms
+        ]
+        dirty_rollup_rooms.clear()
+
+    failed_history = []
+    failed_increments = []
+    failed_rollup_rooms = []
+
+    if history:
+        try:
+            PlayHistory.insert_many(history, ordered=False)
+        except BulkWriteError as e:
+            # insert_many set _id on every document, so a retried duplicate is reported and ignored
+            failed = failed_write_indexes(e, ignore_codes=(DUPLICATE_KEY_ERROR,))
+            failed_history = [doc for i, doc in enumerate(history) if i in failed]
+        except Exception as e:
+            print(f"Error writing play history: {e}")
+            failed_history = history
+
+    if increments:
+        count_operations = [
+            UpdateOne(
+                {'room_key': room_key, 'track_uri': track_uri},
+                {'$inc': {'count': pending['count']}, '$set': {'song': pending['song']}},
+                upsert=True
+            )
+            for (room_key, track_uri), pending in increments
+        ]
+        try:
+            RoomTrackCounts.bulk_write(count_operations, ordered=False)
+        except BulkWriteError as e:
+            failed = failed_write_indexes(e)
+            failed_increments = [increment for i, increment in enumerate(increments) if i in failed]
+        except Exception as e:
+            print(f"Error writing play counts: {e}")
+            failed_increments = increments
+
+    if rollup_operations:
+        try:
+            RoomRollups.bulk_write(rollup_operations, ordered=False)
+        except BulkWriteError as e:
+            failed = failed_write_indexes(e)
+            failed_rollup_rooms = [room_key for i, room_key in enumerate(rollup_rooms) if i in failed]
+        except Exception as e:
+            print(f"Error writing room rollups: {e}")
+            failed_rollup_rooms = rollup_rooms
+
+    with play_history_lock:
+        play_history_flush['scheduled'] = False
+        play_history_flush['failing'] = bool(failed_history or failed_increments or failed_rollup_rooms)
+        if play_history_flush['failing']:
+            print(f"Requeueing {len(failed_history)} plays, {len(failed_increments)} counts, {len(failed_rollup_rooms)} rollups")
+        # Failed plays are older than anything queued meanwhile, so they go back in front
+        pending_play_history[:0] = failed_history
+        queue_play_history([])
+        for key, pending in failed_increments:
+            queue_play_count_increment(key, pending['count'], pending['song'])
+        dirty_rollup_rooms.update(failed_rollup_rooms)
+
+def play_history_loop():
+    try:
+        PlayHistory.create_index([('room_key', 1), ('played_at', -1)])
+        RoomTrackCounts.create_index([('room_key', 1), ('track_uri', 1)], unique=True)
+        RoomRollups.create_index('room_key', unique=True)
+    except Exception as e:
+        print(f"Error creating play history indexes: {e}")
+    while True:
+        socketio.sleep(PLAY_HISTORY_FLUSH_INTERVAL_SECONDS)
+        flush_play_history()
 
 '''--------------------------------------------------------SPOTIFY-INITIALIZATION--------------------------------------------------------'''
 
@@ -335,6 +898,249 @@ def get_spotify_token(user_id):
         print(f"Unexpected error refreshing token for user {user_id}: {e}")
         return None
 
+'''--------------------------------------------------------TRACK-METADATA-CACHE--------------------------------------------------------'''
+
+# Track metadata is effectively immutable, so one cached copy serves every room
+# Key: track_id, Value: (formatted_track: dict, expires_at: float), kept in LRU order
+TRACK_CACHE_MAX_SIZE = int(os.getenv('TRACK_CACHE_MAX_SIZE', 5000))
+TRACK_CACHE_TTL_SECONDS = int(os.getenv('TRACK_CACHE_TTL_SECONDS', 6 * 60 * 60))
+# IDs Spotify does not know are cached as (None, expires_at) so they aren't requested again
+UNKNOWN_TRACK_TTL_SECONDS = int(os.getenv('UNKNOWN_TRACK_TTL_SECONDS', 60 * 60))
+SPOTIFY_TRACKS_BATCH_SIZE = 50  # Upper bound of Spotify's GET /v1/tracks?ids=
+MAX_TRACK_IDS_PER_REQUEST = 200
+
+track_cache = OrderedDict()
+track_cache_lock = threading.Lock()
+
+# Track IDs currently being fetched from Spotify, so concurrent callers wait instead of refetching
+# Key: track_id, Value: threading.Event set once the fetch finishes
+track_fetches_in_flight = {}
+
+SPOTIFY_TRACK_ID_PATTERN = re.compile(r'^[A-Za-z0-9]{22}$')
+
+def format_track(track):
+    """Reshape a full Spotify track object into the song dict the client uses"""
+    artist_name = track['artists'][0]['name'] if track['artists'] else 'Unknown Artist'
+    # Use the first available image, fallback to None
+    artwork_url = None
+    if track['album']['images']:
+        # Prefer medium size (index 1), fallback to first available
+        artwork_url = track['album']['images'][1]['url'] if len(track['album']['images']) > 1 else track['album']['images'][0]['url']
+
+    return {
+        'id': track['id'],
+        'uri': track['uri'],
+        'title': track['name'],
+        'artist': artist_name,
+        'album': track['album']['name'],
+        'artwork': artwork_url,
+        'duration': track['duration_ms'] / 1000,
+        'preview': track.get('preview_url')
+    }
+
+def cache_tracks(songs):
+    """Store formatted songs in the metadata cache, evicting least recently used entries"""
+    expires_at = time.time() + TRACK_CACHE_TTL_SECONDS
+    with track_cache_lock:
+        for song in songs:
+            track_cache[song['id']] = (song, expires_at)
+            track_cache.move_to_end(song['id'])
+        while len(track_cache) > TRACK_CACHE_MAX_SIZE:
+            track_cache.popitem(last=False)
+
+def cache_unknown_tracks(track_ids):
+    """Remember IDs Spotify returned null for"""
+    expires_at = time.time() + UNKNOWN_TRACK_TTL_SECONDS
+    with track_cache_lock:
+        for track_id in track_ids:
+            track_cache[track_id] = (None, expires_at)
+            track_cache.move_to_end(track_id)
+        while len(track_cache) > TRACK_CACHE_MAX_SIZE:
+            track_cache.popitem(last=False)
+
+def lookup_cached_track(track_id):
+    """Return a cached song if present and fresh, None otherwise (including for cached unknown IDs).
+    Caller must hold track_cache_lock"""
+    entry = track_cache.get(track_id)
+    if not entry:
+        return None
+    song, expires_at = entry
+    if expires_at <= time.time():
+        del track_cache[track_id]
+        return None
+    track_cache.move_to_end(track_id)
+    return song
+
+def fetch_tracks_from_spotify(track_ids, token):
+    """Fetch up to SPOTIFY_TRACKS_BATCH_SIZE tracks in a single Spotify request"""
+    headers = {"Authorization": f"Bearer {token}"}
+    params = {"ids": ",".join(track_ids)}
+    response = requests.get("https://api.spotify.com/v1/tracks", headers=headers, params=params, timeout=15)
+    response.raise_for_status()
+    # Spotify returns null in place of unknown IDs
+    return [format_track(track) for track in response.json().get('tracks', []) if track]
+
+def get_tracks_metadata(track_ids, user_id):
+    """Resolve track IDs through the shared cache, fetching misses from Spotify in batches.
+    Returns (songs, error); songs holds whatever resolved even when some chunks failed"""
+    results = {}
+    error = None
+    to_fetch = []
+    to_wait = []
+
+    with track_cache_lock:
+        for track_id in track_ids:
+            song = lookup_cached_track(track_id)
+            if song:
+                results[track_id] = song
+            elif track_id in track_cache:
+                # Fresh miss entry: Spotify doesn't know this ID
+                continue
+            elif track_id in track_fetches_in_flight:
+                to_wait.append((track_id, track_fetches_in_flight[track_id]))
+            else:
+                track_fetches_in_flight[track_id] = threading.Event()
+                to_fetch.append(track_id)
+
+    try:
+        # Only hit the token endpoint when something is actually missing from the cache
+        token = get_spotify_token(user_id) if to_fetch else None
+        if to_fetch and not token:
+            print(f"Failed to get valid token for user {user_id}")
+            error = 'Failed to authenticate with Spotify. Please re-link your account.'
+            to_fetch_chunks = []
+        else:
+            to_fetch_chunks = [to_fetch[i:i + SPOTIFY_TRACKS_BATCH_SIZE] for i in range(0, len(to_fetch), SPOTIFY_TRACKS_BATCH_SIZE)]
+
+        for chunk in to_fetch_chunks:
+            print(f"Fetching {len(chunk)} tracks from Spotify ({len(results)} served from cache)")
+            try:
+                songs = fetch_tracks_from_spotify(chunk, token)
+            except requests.RequestException as e:
+                # Keep the cache hits and chunks already fetched; the caller gets a partial result
+                print(f"Spotify API tracks error for user {user_id}: {e}")
+                error = f'Failed to fetch track data from Spotify: {str(e)}'
+                continue
+            cache_tracks(songs)
+            cache_unknown_tracks(set(chunk) - {song['id'] for song in songs})
+            for song in songs:
+                index_track(song)
+                results[song['id']] = song
+    finally:
+        # Release waiters even if the fetch failed; they fall back to whatever is cached
+        with track_cache_lock:
+            for track_id in to_fetch:
+                track_fetches_in_flight.pop(track_id).set()
+
+    for track_id, fetched in to_wait:
+        fetched.wait(timeout=15)
+        with track_cache_lock:
+            song = lookup_cached_track(track_id)
+        if song:
+            results[track_id] = song
+
+    return [results[track_id] for track_id in track_ids if track_id in results], error
+
+'''--------------------------------------------------------LOCAL-TRACK-INDEX--------------------------------------------------------'''
+
+# In-process token index over tracks the server has resolved from Spotify, used for instant search suggestions
+TRACK_INDEX_MAX_TRACKS = int(os.getenv('TRACK_INDEX_MAX_TRACKS', 20000))
+SUGGESTION_LIMIT = 10
+
+# Popularity added each time a track is seen from a given source
+TRACK_INDEX_SEARCH_WEIGHT = 1
+TRACK_INDEX_PLAY_WEIGHT = 5
+
+# Key: track_id, Value: {'song': dict, 'tokens': set, 'popularity': int}, kept in LRU order
+track_index = OrderedDict()
+
+# Key: token, Value: set of track_ids whose title, artist or album contains the token
+track_index_tokens = {}
+
+# All keys of track_index_tokens in sorted order, so prefix matches are a contiguous range
+track_index_sorted_tokens = []
+
+track_index_lock = threading.Lock()
+
+INDEXED_SONG_FIELDS = ('id', 'uri', 'title', 'artist', 'album', 'artwork', 'duration', 'preview')
+
+def tokenize(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+def remove_indexed_track(track_id):
+    """Drop a track and any tokens only it referenced. Caller must hold track_index_lock"""
+    entry = track_index.pop(track_id)
+    for token in entry['tokens']:
+        ids = track_index_tokens[token]
+        ids.discard(track_id)
+        if not ids:
+            del track_index_tokens[token]
+            del track_index_sorted_tokens[bisect.bisect_left(track_index_sorted_tokens, token)]
+
+def index_track(song, weight=TRACK_INDEX_SEARCH_WEIGHT):
+    """Add a song to the local index, or bump its popularity if it is already there"""
+    track_id = song.get('id') or (song.get('uri') or '').replace('spotify:track:', '')
+    if not track_id or not song.get('title'):
+        return
+
+    with track_index_lock:
+        entry = track_index.get(track_id)
+        if entry:
+            entry['popularity'] += weight
+            track_index.move_to_end(track_id)
+            return
+
+        tokens = set(tokenize(song.get('title')) + tokenize(song.get('artist')) + tokenize(song.get('album')))
+        compact_song = {field: song.get(field) for field in INDEXED_SONG_FIELDS}
+        compact_song['id'] = track_id
+        track_index[track_id] = {'song': compact_song, 'tokens': tokens, 'popularity': weight}
+        for token in tokens:
+            if token not in track_index_tokens:
+                track_index_tokens[token] = set()
+                bisect.insort(track_index_sorted_tokens, token)
+            track_index_tokens[token].add(track_id)
+
+        while len(track_index) > TRACK_INDEX_MAX_TRACKS:
+            remove_indexed_track(next(iter(track_index)))
+
+def index_play(track_uri, weight=0):
+    """Count a play towards a track's popularity.
+    Only metadata resolved from Spotify is indexed, never what a client sent, since suggestions reach every user"""
+    track_id = (track_uri or '').replace('spotify:track:', '')
+    if not SPOTIFY_TRACK_ID_PATTERN.match(track_id):
+        return
+    with track_index_lock:
+        entry = track_index.get(track_id)
+        if entry:
+            entry['popularity'] += weight
+            track_index.move_to_end(track_id)
+            return
+    with track_cache_lock:
+        song = lookup_cached_track(track_id)
+    if song:
+        index_track(song, weight)
+
+def suggest_tracks(query, limit=SUGGESTION_LIMIT):
+    """Return indexed songs matching every query token as a prefix, most popular first"""
+    query_tokens = tokenize(query)
+    if not query_tokens:
+        return []
+
+    with track_index_lock:
+        candidates = None
+        for query_token in set(query_tokens):
+            matches = set()
+            position = bisect.bisect_left(track_index_sorted_tokens, query_token)
+            while position < len(track_index_sorted_tokens) and track_index_sorted_tokens[position].startswith(query_token):
+                matches |= track_index_tokens[track_index_sorted_tokens[position]]
+                position += 1
+            candidates = matches if candidates is None else candidates & matches
+            if not candidates:
+                return []
+
+        ranked = sorted(candidates, key=lambda track_id: track_index[track_id]['popularity'], reverse=True)[:limit]
+        return [dict(track_index[track_id]['song']) for track_id in ranked]
+
 '''--------------------------------------------------------HELPER-FUNCTION--------------------------------------------------------'''
 
 def generate_room_key(length=5):
@@ -701,6 +1507,43 @@ def public_rooms_api():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
+@app.route('/api/rate-limit-stats', methods=['GET'])
+def rate_limit_stats_api():
+    return jsonify({
+        'throttled': dict(throttled_events),
+        'shed': dict(shed_events),
+        'load_per_second': load_window['last_load'],
+        'buckets': len(rate_limit_buckets)
+    })
+
+'''--------------------------------------------------------ROOM-LEADERBOARD-ROUTES--------------------------------------------------------'''
+
+@app.route('/api/rooms/<room_key>/top-tracks', methods=['GET'])
+def room_top_tracks_api(room_key):
+    if "user" not in session:
+        return jsonify({'error': 'User not authenticated'}), 401
+    if not find_room(room_key):
+        return jsonify({'error': 'Room not found.'}), 404
+    # Rooms with no plays are answered without being cached
+    if not load_room_rollups(room_key, cache_empty=False):
+        return jsonify([])
+    with play_history_lock:
+        counts = room_play_counts.get(room_key, {})
+        top_tracks = [dict(counts[uri]['song'], play_count=counts[uri]['count']) for uri in room_top_tracks.get(room_key, [])]
+    return jsonify(top_tracks)
+
+@app.route('/api/rooms/<room_key>/recent-plays', methods=['GET'])
+def room_recent_plays_api(room_key):
+    if "user" not in session:
+        return jsonify({'error': 'User not authenticated'}), 401
+    if not find_room(room_key):
+        return jsonify({'error': 'Room not found.'}), 404
+    if not load_room_rollups(room_key, cache_empty=False):
+        return jsonify([])
+    with play_history_lock:
+        recent_plays = list(room_recent_plays.get(room_key, []))
+    return jsonify(recent_plays)
+
 '''--------------------------------------------------------SEARCH-SONG-ROUTE--------------------------------------------------------'''
 
 @app.route('/api/search', methods=['GET'])
@@ -716,6 +1559,10 @@ def search_songs():
         print(f"Empty search term from user {user_id}")
         return jsonify({'error': 'Search term is required'}), 400
 
+    if not allow_event('api_search', {'user': user_id}):
+        print(f"Search rate limit exceeded for user {user_id}")
+        return jsonify({'error': 'Too many searches. Please slow down.'}), 429
+
     print(f"Search request from user {user_id} for: {search_term}")
     token = get_spotify_token(user_id)
     if not token:
@@ -750,28 +1597,13 @@ def search_songs():
         response.raise_for_status()
         spotify_data = response.json()
 
-        songs = []
         tracks = spotify_data.get('tracks', {}).get('items', [])
         print(f"Found {len(tracks)} tracks for search: {search_term}")
-        
-        for track in tracks:
-            artist_name = track['artists'][0]['name'] if track['artists'] else 'Unknown Artist'
-            # Use the first available image, fallback to None
-            artwork_url = None
-            if track['album']['images']:
-                # Prefer medium size (index 1), fallback to first available
-                artwork_url = track['album']['images'][1]['url'] if len(track['album']['images']) > 1 else track['album']['images'][0]['url']
-            
-            songs.append({
-                'id': track['id'],
-                'uri': track['uri'],
-                'title': track['name'],
-                'artist': artist_name,
-                'album': track['album']['name'],
-                'artwork': artwork_url,
-                'duration': track['duration_ms'] / 1000, 
-                'preview': track['preview_url']
-            })
+
+        songs = [format_track(track) for track in tracks]
+        cache_tracks(songs)
+        for song in songs:
+            index_track(song)
         
         print(f"Returning {len(songs)} songs to user {user_id}")
         return jsonify(songs)
@@ -783,6 +1615,69 @@ def search_songs():
         print(f"Unexpected error in search for user {user_id}: {e}")
         return jsonify({'error': 'An unexpected error occurred while searching'}), 500
 
+'''--------------------------------------------------------SUGGEST-SONG-ROUTE--------------------------------------------------------'''
+
+@app.route('/api/suggest', methods=['GET'])
+def suggest_songs():
+    search_term = request.args.get('q', '').strip()
+    if not session.get('user'):
+        return jsonify({'error': 'User not authenticated'}), 401
+    if not search_term:
+        return jsonify({'error': 'Search term is required'}), 400
+    if not allow_event('api_suggest', {'user': session.get('user')}):
+        return jsonify({'error': 'Too many requests. Please slow down.'}), 429
+
+    # Served entirely from the local index; clients fall back to /api/search when this runs dry
+    return jsonify(suggest_tracks(search_term))
+
+'''--------------------------------------------------------TRACK-METADATA-ROUTE--------------------------------------------------------'''
+
+@app.route('/api/tracks', methods=['GET'])
+def tracks_metadata():
+    user_id = session.get('user')
+    if not user_id:
+        return jsonify({'error': 'User not authenticated'}), 401
+
+    # Accept bare IDs or spotify:track: URIs, de-duplicated in request order
+    raw_ids = [i.strip().replace('spotify:track:', '') for i in request.args.get('ids', '').split(',')]
+    track_ids = list(dict.fromkeys(i for i in raw_ids if SPOTIFY_TRACK_ID_PATTERN.match(i)))
+
+    if not track_ids:
+        return jsonify({'error': 'At least one valid track id is required'}), 400
+    if len(track_ids) > MAX_TRACK_IDS_PER_REQUEST:
+        return jsonify({'error': f'At most {MAX_TRACK_IDS_PER_REQUEST} track ids per request'}), 400
+
+    if not allow_event('api_tracks', {'user': user_id}):
+        return jsonify({'error': 'Too many track lookups. Please slow down.'}), 429
+
+    try:
+        songs, error = get_tracks_metadata(track_ids, user_id)
+        if error and not songs:
+            return jsonify({'error': error}), 500
+        return jsonify(songs)
+    except Exception as e:
+        print(f"Unexpected error fetching tracks for user {user_id}: {e}")
+        return jsonify({'error': 'An unexpected error occurred while fetching tracks'}), 500
+
+'''--------------------------------------------------------HEALTH-ROUTES--------------------------------------------------------'''
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness: the process is up and serving requests
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    # Readiness: take this instance out of rotation while draining or when Mongo is unreachable
+    if server_state['draining']:
+        return jsonify({'status': 'draining'}), 503
+    try:
+        get_mongo_db().client.admin.command('ping')
+    except Exception as e:
+        print(f"Readiness check failed: {e}")
+        return jsonify({'status': 'unavailable', 'error': str(e)}), 503
+    return jsonify({'status': 'ready'})
+
 '''--------------------------------------------------------LOGOUT-ROUTE--------------------------------------------------------'''
 
 @app.route('/logout', methods=["POST"])
@@ -793,7 +1688,58 @@ def logout():
 
 '''--------------------------------------------------------RUN-APP--------------------------------------------------------'''
         
-if __name__ == '__main__':
+def drain_server(previous_handler):
+    """Stop accepting joins, persist room state, ask clients to reconnect elsewhere, then exit"""
+    print("SIGTERM received, draining")
+    flush_room_snapshots()
+    flush_play_history()
+    # Only this process's clients, with their reconnects spread over the grace period.
+    # A plain broadcast would go through the message queue and disconnect every instance's clients
+    for sids in list(room_listeners.values()):
+        for sid in list(sids):
+            socketio.emit('server_draining', {'reconnect_delay_ms': random.randint(0, DRAIN_GRACE_SECONDS * 1000)}, room=sid)
+    socketio.sleep(DRAIN_GRACE_SECONDS)
+    # Pick up anything that changed while clients were leaving
+    flush_room_snapshots()
+    flush_play_history()
+    print("Drain complete, shutting down")
+    # Hand the signal back to the previous handler (gunicorn's, or the default which terminates)
+    signal.signal(signal.SIGTERM, previous_handler)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+def install_drain_handler():
+    previous_handler = signal.getsignal(signal.SIGTERM)
+    if previous_handler is None:
+        previous_handler = signal.SIG_DFL
+
+    def handle_sigterm(signum, frame):
+        if server_state['draining']:
+            return
+        server_state['draining'] = True
+        socketio.start_background_task(drain_server, previous_handler)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+def create_app():
+    """Bind extensions and start background tasks. Safe to call more than once"""
+    if server_state['initialized']:
+        return app
+    server_state['initialized'] = True
+
+    db.init_app(app)
+    socketio.init_app(app, async_mode=ASYNC_MODE, message_queue=SOCKETIO_MESSAGE_QUEUE)
     with app.app_context():
         db.create_all()
-    socketio.run(app, port='4444', host='0.0.0.0', debug=False)
\ No newline at end of file
+
+    socketio.start_background_task(room_snapshot_loop)
+    socketio.start_background_task(play_history_loop)
+    install_drain_handler()
+    return app
+        
+if __name__ == '__main__':
+    # Development entry point; production runs under gunicorn (see gunicorn.conf.py)
+    create_app()
+    if ASYNC_MODE == 'threading':
+        socketio.run(app, port=PORT, host=HOST, debug=False, allow_unsafe_werkzeug=True)
+    else:
+        socketio.run(app, port=PORT, host=HOST, debug=False)
\ No newline at end of file
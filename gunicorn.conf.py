@@ -0,0 +1,14 @@
+# Production entry point: gunicorn -c gunicorn.conf.py "app:create_app()"
+import os
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', 4444)}"
+
+# Socket.IO long-polling needs sticky sessions, which gunicorn's balancer does not provide.
+# Run more than one worker only behind a sticky load balancer and with SOCKETIO_MESSAGE_QUEUE set.
+workers = int(os.getenv('WORKERS', 1))
+worker_class = 'eventlet' if os.getenv('ASYNC_MODE', 'eventlet') == 'eventlet' else 'gthread'
+threads = int(os.getenv('THREADS', 50)) if worker_class == 'gthread' else 1
+
+# Must exceed DRAIN_GRACE_SECONDS so the SIGTERM drain can finish before the worker is killed
+graceful_timeout = int(os.getenv('DRAIN_GRACE_SECONDS', 10)) + 20
+timeout = 60
@@ -98,6 +98,10 @@ document.addEventListener('DOMContentLoaded', () => {
   if (!musicSearchInput || !musicResultsContainer) return;
 
   let searchTimeout = null;
+  let fallbackTimeout = null;
+  const SUGGEST_DEBOUNCE = 150;
+  const SEARCH_DEBOUNCE = 500;
+  const SUGGESTION_LIMIT = 10; // Matches SUGGESTION_LIMIT in app.py
 
   const renderResults = (songs) => {
     musicResultsContainer.innerHTML = '';
@@ -108,29 +112,89 @@ document.addEventListener('DOMContentLoaded', () => {
     songs.forEach(song => {
       const card = document.createElement('div');
       card.className = 'music-card';
-      card.innerHTML = `
-        <img src="${song.artwork || ''}" alt="${song.album || ''}" class="song-artwork"/>
-        <div class="song-info">
-          <p class="song-title">${song.title || ''}</p>
-          <p class="song-artist">${song.artist || ''}</p>
-        </div>
-        ${song.preview ? `<audio controls src="${song.preview}" style="width:100%"></audio>` : ''}
-      `;
+
+      // Build the card from text nodes and attributes; song fields are never parsed as HTML
+      const artwork = document.createElement('img');
+      artwork.src = song.artwork || '';
+      artwork.alt = song.album || '';
+      artwork.className = 'song-artwork';
+
+      const info = document.createElement('div');
+      info.className = 'song-info';
+      const title = document.createElement('p');
+      title.className = 'song-title';
+      title.textContent = song.title || '';
+      const artist = document.createElement('p');
+      artist.className = 'song-artist';
+      artist.textContent = song.artist || '';
+      info.append(title, artist);
+      card.append(artwork, info);
+
+      if (song.preview) {
+        const preview = document.createElement('audio');
+        preview.controls = true;
+        preview.src = song.preview;
+        preview.style.width = '100%';
+        card.appendChild(preview);
+      }
       musicResultsContainer.appendChild(card);
     });
   };
 
-  const fetchResults = (q) => {
+  // Local suggestions first, then Spotify results not already shown
+  const mergeResults = (localSongs, spotifySongs) => {
+    const seen = new Set(localSongs.map(song => song.id));
+    return localSongs.concat(spotifySongs.filter(song => !seen.has(song.id)));
+  };
+
+  const fetchResults = (q, localSongs = []) => {
     if (!q) { musicResultsContainer.innerHTML = ''; return; }
     fetch(`/api/search?q=${encodeURIComponent(q)}`)
-      .then(r => r.json())
-      .then(renderResults)
-      .catch(() => { musicResultsContainer.innerHTML = '<p>Failed to load music results.</p>'; });
+      .then(r => r.json().then(body => {
+        if (!r.ok) throw new Error(body.error || `HTTP error! status: ${r.status}`);
+        return body;
+      }))
+      .then(songs => renderResults(mergeResults(localSongs, songs)))
+      .catch((error) => {
+        // Keep showing local suggestions if there are any
+        if (localSongs.length > 0) return;
+        musicResultsContainer.innerHTML = '';
+        const message = document.createElement('p');
+        message.textContent = error.message || 'Failed to load music results.';
+        musicResultsContainer.appendChild(message);
+      });
+  };
+
+  // Suggestions come from the server's local track index; Spotify fills in when it returns less than a full page
+  const fetchSuggestions = (q) => {
+    if (!q) { musicResultsContainer.innerHTML = ''; return; }
+    fetch(`/api/suggest?q=${encodeURIComponent(q)}`)
+      .then(r => r.ok ? r.json() : [])
+      .then(songs => {
+        // Ignore responses for text the user has already changed
+        if (musicSearchInput.value.trim() !== q) return;
+        songs = songs || [];
+        if (songs.length > 0) {
+          renderResults(songs);
+        }
+        if (songs.length < SUGGESTION_LIMIT) {
+          // Same 500ms debounce as before for the Spotify fall-through
+          fallbackTimeout = setTimeout(() => fetchResults(q, songs), SEARCH_DEBOUNCE - SUGGEST_DEBOUNCE);
+        }
+      })
+      .catch(() => {
+        fallbackTimeout = setTimeout(() => fetchResults(q), SEARCH_DEBOUNCE - SUGGEST_DEBOUNCE);
+      });
   };
 
   musicSearchInput.addEventListener('keyup', (e) => {
     const q = e.target.value.trim();
     clearTimeout(searchTimeout);
-    searchTimeout = setTimeout(() => fetchResults(q), 500);
+    clearTimeout(fallbackTimeout);
+    if (e.key === 'Enter') {
+      fetchResults(q);
+      return;
+    }
+    searchTimeout = setTimeout(() => fetchSuggestions(q), SUGGEST_DEBOUNCE);
   });
 })();
\ No newline at end of file
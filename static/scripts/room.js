@@ -278,20 +278,17 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    // Function to get detailed track information from Spotify API
+    // Function to get detailed track information via the server's shared track cache
     function getTrackDetails(trackUri) {
-        if (!trackUri || !accessToken) return Promise.resolve(null);
+        if (!trackUri) return Promise.resolve(null);
         const trackId = trackUri.replace('spotify:track:', '');
         
-        return fetch(`https://api.spotify.com/v1/tracks/${trackId}`, {
-            headers: {
-                'Authorization': `Bearer ${accessToken}`
-            }
-        })
+        return fetch(`/api/tracks?ids=${encodeURIComponent(trackId)}`)
         .then(response => {
             if (response.ok) return response.json();
             return null;
         })
+        .then(tracks => (tracks && tracks.length) ? tracks[0] : null)
         .catch(error => {
             console.error('Error fetching track details:', error);
             return null;
@@ -301,6 +298,10 @@ document.addEventListener('DOMContentLoaded', () => {
     // ------------------- MUSIC SEARCH LOGIC -------------------
     if (musicSearchInput && musicResultsContainer) {
         let searchTimeoutId = null;
+        let fallbackTimeoutId = null;
+        const SUGGEST_DEBOUNCE = 150;
+        const SEARCH_DEBOUNCE = 500;
+        const SUGGESTION_LIMIT = 10; // Matches SUGGESTION_LIMIT in app.py
 
         const renderResults = (songs) => {
             musicResultsContainer.innerHTML = '';
@@ -316,14 +317,23 @@ document.addEventListener('DOMContentLoaded', () => {
                 card.dataset.songArtist = song.artist;
                 card.dataset.songArtwork = song.artwork;
                 
-                // Construct the innerHTML for the card
-                card.innerHTML = `
-                    <img src="${song.artwork || DEFAULT_ARTWORK}" alt="Album Artwork" class="music-card-artwork">
-                    <div class="music-card-info">
-                        <span class="song-title">${song.title || 'Unknown Title'}</span>
-                        <span class="song-artist">${song.artist || 'Unknown Artist'}</span>
-                    </div>
-                `;
+                // Build the card from text nodes and attributes; song fields are never parsed as HTML
+                const artwork = document.createElement('img');
+                artwork.src = song.artwork || DEFAULT_ARTWORK;
+                artwork.alt = 'Album Artwork';
+                artwork.className = 'music-card-artwork';
+
+                const info = document.createElement('div');
+                info.className = 'music-card-info';
+                const title = document.createElement('span');
+                title.className = 'song-title';
+                title.textContent = song.title || 'Unknown Title';
+                const artist = document.createElement('span');
+                artist.className = 'song-artist';
+                artist.textContent = song.artist || 'Unknown Artist';
+                info.append(title, artist);
+
+                card.append(artwork, info);
                 
                 card.addEventListener('click', () => {
                     const songUri = card.dataset.songUri;
@@ -337,7 +347,13 @@ document.addEventListener('DOMContentLoaded', () => {
         };
 
 
-        const fetchResults = (q) => {
+        // Local suggestions first, then Spotify results not already shown
+        const mergeResults = (localSongs, spotifySongs) => {
+            const seen = new Set(localSongs.map(song => song.id));
+            return localSongs.concat(spotifySongs.filter(song => !seen.has(song.id)));
+        };
+
+        const fetchResults = (q, localSongs = []) => {
             if (!q) { musicResultsContainer.innerHTML = ''; return; }
             fetch(`/api/search?q=${encodeURIComponent(q)}`)
                 .then(r => {
@@ -346,17 +362,47 @@ document.addEventListener('DOMContentLoaded', () => {
                     }
                     return r.json();
                 })
-                .then(renderResults)
+                .then(songs => renderResults(mergeResults(localSongs, songs)))
                 .catch(error => { 
                     console.error('Error fetching music:', error);
-                    musicResultsContainer.innerHTML = '<p>Failed to load music results.</p>'; 
+                    // Keep showing local suggestions if there are any
+                    if (localSongs.length === 0) {
+                        musicResultsContainer.innerHTML = '<p>Failed to load music results.</p>'; 
+                    }
+                });
+        };
+
+        // Suggestions come from the server's local track index; Spotify fills in when it returns less than a full page
+        const fetchSuggestions = (q) => {
+            if (!q) { musicResultsContainer.innerHTML = ''; return; }
+            fetch(`/api/suggest?q=${encodeURIComponent(q)}`)
+                .then(r => r.ok ? r.json() : [])
+                .then(songs => {
+                    // Ignore responses for text the user has already changed
+                    if (musicSearchInput.value.trim() !== q) return;
+                    songs = songs || [];
+                    if (songs.length > 0) {
+                        renderResults(songs);
+                    }
+                    if (songs.length < SUGGESTION_LIMIT) {
+                        // Same 500ms debounce as before for the Spotify fall-through
+                        fallbackTimeoutId = setTimeout(() => fetchResults(q, songs), SEARCH_DEBOUNCE - SUGGEST_DEBOUNCE);
+                    }
+                })
+                .catch(() => {
+                    fallbackTimeoutId = setTimeout(() => fetchResults(q), SEARCH_DEBOUNCE - SUGGEST_DEBOUNCE);
                 });
         };
 
         musicSearchInput.addEventListener('keyup', (e) => {
             const q = e.target.value.trim();
             clearTimeout(searchTimeoutId);
-            searchTimeoutId = setTimeout(() => fetchResults(q), 500);
+            clearTimeout(fallbackTimeoutId);
+            if (e.key === 'Enter') {
+                fetchResults(q);
+                return;
+            }
+            searchTimeoutId = setTimeout(() => fetchSuggestions(q), SUGGEST_DEBOUNCE);
         });
     }
 
@@ -365,6 +411,26 @@ document.addEventListener('DOMContentLoaded', () => {
         socket.emit('join', { username: username, room_key: roomKey });
     });
 
+    // The server is shutting down: reconnect (through the load balancer) to another instance
+    socket.on('server_draining', (data) => {
+        const delay = (data && data.reconnect_delay_ms) || 0;
+        console.log(`Server draining, reconnecting in ${delay}ms.`);
+        socket.disconnect();
+        setTimeout(() => socket.connect(), delay);
+    });
+
+    // The server dropped one of our events; for playback events a sync_playback follows to restore the room's state
+    socket.on('rate_limited', (data) => {
+        console.warn('Rate limited by server:', data.event);
+        if (data.event === 'sync_request') {
+            // Our initial sync was dropped; ask again once the server says we may
+            setTimeout(() => socket.emit('sync_request', { room_key: roomKey }), data.retry_after_ms || 1000);
+            return;
+        }
+        playerStatus.textContent = 'Too many playback changes. Resyncing with the room...';
+        setTimeout(() => { playerStatus.textContent = ''; }, 3000);
+    });
+
     socket.on('new_message', (data) => {
         const messageElement = document.createElement('div');
         messageElement.innerHTML = `<strong>${data.username}:</strong> ${data.msg}`;